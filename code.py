@@ -16,13 +16,100 @@ bl_info = {
 }
 
 
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 import bpy
 import numpy as np
-from mathutils import Vector
-from math import sqrt
 
+try:
+    # the numeric helpers are compiled with numba when it is available,
+    # they release the GIL so the render threads can run them in parallel
+    from numba import njit
 
-def ray_cast(scene, origin, direction):
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+    # numba is not bundled with Blender's Python,
+    # without it the helpers below simply run as plain Python functions
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+
+# size in pixels of the square tiles the image is rendered in
+TILE_SIZE = 32
+
+# reflected and transmitted rays that contribute less than this
+# to the pixel color are not traced
+MIN_THROUGHPUT = 1e-3
+
+# object types that Scene.ray_cast() can hit
+RAY_CAST_TYPES = {"MESH", "CURVE", "SURFACE", "META", "FONT"}
+
+# custom object property marking an object as an analytic "SPHERE" or "PLANE"
+# when every object is marked, rays are intersected without Blender's ray_cast
+PRIMITIVE_PROPERTY = "simpleRT_primitive"
+
+
+def _rgb0(color, scale=1.0):
+    """RGB of a color as a float32 array of 4 items with a zero last item
+    All the colors are kept 4 wide, so that the color arithmetic works on
+    aligned 4 lane vectors instead of 3 lane ones
+    """
+    return np.array(
+        (color[0] * scale, color[1] * scale, color[2] * scale, 0.0), dtype=np.float32
+    )
+
+
+@dataclass(slots=True)
+class MatSnap:
+    """Snapshot of the simpleRT_material of an object
+    Reading material properties through bpy is slow,
+    so they are copied into plain floats and arrays once per render
+    Attributes
+    ----------
+    diffuse : numpy.ndarray, float32 array of 4 items
+        RGB of the diffuse color, padded with a zero
+    specular : numpy.ndarray, float32 array of 4 items
+        RGB of the specular color, padded with a zero
+    specular_hardness : float
+        The Phong exponent
+    mirror_reflectivity : float
+        Reflectivity k_r when fresnel is not used
+    use_fresnel : bool
+        Whether k_r is calculated using Schlick's approximation
+    ior : float
+        Index of refraction
+    transmission : float
+        Amount of light transmitted through the object
+    """
+
+    diffuse: np.ndarray
+    specular: np.ndarray
+    specular_hardness: float
+    mirror_reflectivity: float
+    use_fresnel: bool
+    ior: float
+    transmission: float
+
+    @classmethod
+    def from_object(cls, obj):
+        mat = obj.simpleRT_material
+        return cls(
+            diffuse=_rgb0(mat.diffuse_color),
+            specular=_rgb0(mat.specular_color),
+            specular_hardness=mat.specular_hardness,
+            mirror_reflectivity=mat.mirror_reflectivity,
+            use_fresnel=mat.use_fresnel,
+            ior=mat.ior,
+            transmission=mat.transmission,
+        )
+
+
+def ray_cast(scene, origin, direction, primitives=None, depsgraph=None):
     """wrapper around Blender's Scene.ray_cast() API
     Parameters
     ----------
@@ -32,6 +119,14 @@ def ray_cast(scene, origin, direction):
         Origin of the ray
     direction : Vector, float array of 3 items
         Direction of the ray
+    primitives : tuple or None
+        The analytic scene geometry from _analytic_primitives()
+        when it is given, the ray is intersected with it instead of calling Blender,
+        index is then -1 and matrix is None
+    depsgraph : bpy.types.Depsgraph or None
+        The dependency graph to cast the ray in, scene.view_layers[0].depsgraph
+        when None. Looking it up costs a few RNA property accesses,
+        so callers casting many rays pass it in
     Returns
     -------
     has_hit : bool
@@ -48,100 +143,549 @@ def ray_cast(scene, origin, direction):
     matrix: Matrix, float 4 * 4
         The matrix_world of the hit object
     """
-    return scene.ray_cast(scene.view_layers[0].depsgraph, origin, direction)
+    if primitives is not None:
+        hit_objects, *arrays = primitives
+        index, hit_loc, hit_norm = _intersect_primitives(origin, direction, *arrays)
+        if index < 0:
+            return False, hit_loc, hit_norm, -1, None, None
+        return True, hit_loc, hit_norm, -1, hit_objects[index], None
+    if depsgraph is None:
+        depsgraph = scene.view_layers[0].depsgraph
+    return scene.ray_cast(depsgraph, origin, direction)
+
+
+def _dot3(a, b):
+    """Dot product of two vectors of 3 items
+    np.dot has a large call overhead compared to the arithmetic on 3 items
+    """
+    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+
+# compiled shaders from _make_shader(), keyed by (n_lights, hardness)
+_shaders = {}
+
+
+def _make_shader(n_lights, hardness):
+    """Blinn-Phong shader specialized for a number of lights and a Phong exponent
+    n_lights and hardness are closure constants of the compiled function,
+    so numba can unroll the light loop and fold the power into multiplications.
+    The shaders are cached, a render only compiles one per distinct hardness.
+    Parameters
+    ----------
+    n_lights : int
+        The number of lights K in the scene
+    hardness : float
+        Specular hardness aka the Phong exponent
+    Returns
+    -------
+    shade : function
+        shade(hit_norm, ray_dir, light_dirs, light_intensities, lit, diffuse, specular)
+        hit_norm : numpy.ndarray, float array of 3 items
+            The surface normal at the hit location, facing the ray origin
+        ray_dir : numpy.ndarray, float array of 3 items
+            Direction of the ray
+        light_dirs : numpy.ndarray, float array of shape (K, 3)
+            Normalized directions from the hit location to the lights
+        light_intensities : numpy.ndarray, float32 array of shape (K, 4)
+            I_light of the lights, their color attenuated by the inverse-square law,
+            padded with a zero
+        lit : numpy.ndarray, bool array of K items
+            False for the lights the hit location is in the shadow of
+        diffuse : numpy.ndarray, float32 array of 4 items
+            Diffuse color of the material, padded with a zero
+        specular : numpy.ndarray, float32 array of 4 items
+            Specular color of the material, padded with a zero
+        returns the sum of I_diffuse + I_specular over the lit lights,
+        as a float32 array of 4 items padded with a zero
+    """
+    key = (n_lights, hardness)
+    shade = _shaders.get(key)
+    if shade is not None:
+        return shade
+
+    # closures are not cached on disk by numba, so these compile once per session
+    @njit(fastmath=True, nogil=True)
+    def shade(hit_norm, ray_dir, light_dirs, light_intensities, lit, diffuse, specular):
+        color = np.zeros(4, dtype=np.float32)
+        for k in range(n_lights):
+            if not lit[k]:
+                continue
+
+            # light_dir dot normal_dir, and half_vector = light_dir + view_dir
+            half_vector = np.empty(3, dtype=np.float32)
+            n_dot_l = 0.0
+            half_sq = 0.0
+            for i in range(3):
+                n_dot_l += light_dirs[k, i] * hit_norm[i]
+                half_vector[i] = light_dirs[k, i] - ray_dir[i]
+                half_sq += half_vector[i] * half_vector[i]
+            inv_half = 1.0 / math.sqrt(half_sq)
+            # a light below the surface adds no diffuse light
+            # instead of a negative amount
+            n_dot_l = max(n_dot_l, 0.0)
+
+            # normal_dir dot half_vector, the specular term is zero when it is negative
+            # and the power is only taken when it contributes
+            n_dot_h = 0.0
+            for i in range(3):
+                n_dot_h += hit_norm[i] * half_vector[i] * inv_half
+            if n_dot_h <= 0.0:
+                specular_power = 0.0
+            else:
+                specular_power = math.pow(n_dot_h, hardness)
+
+            # all 4 lanes are computed, the padding lane stays zero
+            for i in range(4):
+                color[i] += light_intensities[k, i] * (
+                    diffuse[i] * n_dot_l + specular[i] * specular_power
+                )
+        return color
+
+    _shaders[key] = shade
+    return shade
+
 
+@njit(cache=True, fastmath=True, nogil=True)
+def _fresnel_schlick(cos_theta, ior):
+    """Reflectivity k_r from Schlick's approximation
+    Parameters
+    ----------
+    cos_theta : float
+        Cosine of the incident angle
+    ior : float
+        Index of refraction of the object, the one of air is 1
+    Returns
+    -------
+    reflectivity : float
+        R_0 + (1 - R_0) (1 - cos(theta))^5
+    """
+    R_0 = ((1.0 - ior) / (1.0 + ior)) ** 2
+    return R_0 + (1.0 - R_0) * math.pow(1.0 - cos_theta, 5)
+
+
+@njit(cache=True, fastmath=True, nogil=True)
+def _refract(ray_dir, hit_norm, n_ratio):
+    """Direction of the transmitted ray
+    Parameters
+    ----------
+    ray_dir : numpy.ndarray, float array of 3 items
+        Direction of the incident ray
+    hit_norm : numpy.ndarray, float array of 3 items
+        The surface normal at the hit location, facing the ray origin
+    n_ratio : float
+        n1 / n2, the ratio of the refractive indices
+    Returns
+    -------
+    has_transmit : bool
+        False on total internal reflection
+    D_transmit : numpy.ndarray, float array of 3 items
+        The transmitted direction, only valid when has_transmit is True
+    """
+    D_transmit = np.zeros(3, dtype=np.float32)
+    cos_theta_i = 0.0
+    for i in range(3):
+        cos_theta_i -= hit_norm[i] * ray_dir[i]
+    cos_theta_t2 = 1.0 - n_ratio * n_ratio * (1.0 - cos_theta_i * cos_theta_i)
+    # the value under the square root must be positive
+    if cos_theta_t2 < 0.0:
+        return False, D_transmit
+    k = n_ratio * cos_theta_i - math.sqrt(cos_theta_t2)
+    for i in range(3):
+        D_transmit[i] = n_ratio * ray_dir[i] + k * hit_norm[i]
+    return True, D_transmit
+
+
+def _ray_cast_instances(depsgraph):
+    """Everything a ray can hit, including the objects placed by instancers
+    Parameters
+    ----------
+    depsgraph : bpy.types.Depsgraph
+        The evaluated dependency graph of the scene
+    Returns
+    -------
+    instances : list of tuple
+        (obj, is_instance, matrix_world, bound_box) for every instance,
+        obj is the original object, matrix_world is a 4x4 numpy.ndarray
+        and bound_box the 8 local space corners as a (8, 3) numpy.ndarray
+    """
+    instances = []
+    for instance in depsgraph.object_instances:
+        # the instance data is only valid during the iteration,
+        # so everything needed later is copied out here
+        obj = instance.object
+        if obj.type not in RAY_CAST_TYPES:
+            continue
+        instances.append(
+            (
+                obj.original,
+                instance.is_instance,
+                np.array(instance.matrix_world),
+                np.array(obj.bound_box),
+            )
+        )
+    return instances
+
+
+def _world_bounds(instances, pad=1e-3):
+    """World space axis aligned bounding boxes of object instances
+    Parameters
+    ----------
+    instances : list of tuple
+        The instances from _ray_cast_instances() to get the bounding boxes of
+    pad : float
+        The boxes are grown by this much on every side,
+        so that flat objects still have a volume
+    Returns
+    -------
+    bounds_min : numpy.ndarray, float32 array of shape (N, 3)
+        Minimum corners of the boxes
+    bounds_max : numpy.ndarray, float32 array of shape (N, 3)
+        Maximum corners of the boxes
+    """
+    bounds_min = np.zeros((len(instances), 3), dtype=np.float32)
+    bounds_max = np.zeros((len(instances), 3), dtype=np.float32)
+    for i, (_, _, matrix, bound_box) in enumerate(instances):
+        # transform the 8 local space corners of the bounding box to world space
+        corners = bound_box @ matrix[:3, :3].T + matrix[:3, 3]
+        bounds_min[i] = corners.min(axis=0) - pad
+        bounds_max[i] = corners.max(axis=0) + pad
+    return bounds_min, bounds_max
+
+
+def _primary_hit_mask(ray_orig, inv_dirs, bounds_min, bounds_max):
+    """Slab test of all the primary rays against a list of axis aligned bounding boxes
+    Parameters
+    ----------
+    ray_orig : numpy.ndarray, float array of 3 items
+        Origin shared by all the rays
+    inv_dirs : numpy.ndarray, float array of shape (H, W, 3)
+        1 / direction of every ray, computed per component
+    bounds_min : numpy.ndarray, float array of shape (N, 3)
+        Minimum corners of the boxes
+    bounds_max : numpy.ndarray, float array of shape (N, 3)
+        Maximum corners of the boxes
+    Returns
+    -------
+    hit_mask : numpy.ndarray, bool array of shape (H, W)
+        If the ray of the pixel hits any of the boxes in front of its origin
+    """
+    hit_mask = np.zeros(inv_dirs.shape[:2], dtype=bool)
+    # one box at a time for all the pixels, the temporaries stay (H, W, 3)
+    for box_min, box_max in zip(bounds_min, bounds_max):
+        t_0 = (box_min - ray_orig) * inv_dirs
+        t_1 = (box_max - ray_orig) * inv_dirs
+        t_near = np.maximum(np.minimum(t_0, t_1).max(axis=-1), 0.0)
+        t_far = np.maximum(t_0, t_1).min(axis=-1)
+        hit_mask |= t_near <= t_far
+    return hit_mask
 
-def RT_trace_ray(scene, ray_orig, ray_dir, lights, depth=0):
+
+@njit(cache=True, fastmath=True, nogil=True)
+def _intersect_primitives(
+    ray_orig,
+    ray_dir,
+    sphere_centers,
+    sphere_radii,
+    plane_centers,
+    plane_u,
+    plane_v,
+    plane_normals,
+):
+    """Closest hit of a ray with analytic spheres and rectangular planes
+    Parameters
+    ----------
+    ray_orig : numpy.ndarray, float array of 3 items
+        Origin of the ray
+    ray_dir : numpy.ndarray, float array of 3 items
+        Direction of the ray
+    sphere_centers : numpy.ndarray, float array of shape (N, 3)
+        Centers of the N spheres
+    sphere_radii : numpy.ndarray, float array of N items
+        Radii of the spheres
+    plane_centers : numpy.ndarray, float array of shape (M, 3)
+        Centers of the M planes
+    plane_u, plane_v : numpy.ndarray, float array of shape (M, 3)
+        Half edges of the planes, from the center to the middle of a side
+    plane_normals : numpy.ndarray, float array of shape (M, 3)
+        Normalized normals of the planes
+    Returns
+    -------
+    index : int
+        Index of the hit primitive, spheres first and then planes
+        -1 when the ray hits nothing
+    hit_loc : numpy.ndarray, float32 array of 3 items
+        The hit location
+    hit_norm : numpy.ndarray, float32 array of 3 items
+        The surface normal at the hit location
+    """
+    index = -1
+    # fastmath assumes there are no infs, so start from a huge finite distance
+    t_hit = 1e30
+    hit_loc = np.zeros(3, dtype=np.float32)
+    hit_norm = np.zeros(3, dtype=np.float32)
+
+    a = 0.0
+    for i in range(3):
+        a += ray_dir[i] * ray_dir[i]
+
+    # solve |o + t d - c|^2 = r^2 for the nearest t > 0
+    for k in range(sphere_centers.shape[0]):
+        half_b = 0.0
+        c = 0.0
+        for i in range(3):
+            oc = ray_orig[i] - sphere_centers[k, i]
+            half_b += oc * ray_dir[i]
+            c += oc * oc
+        c -= sphere_radii[k] * sphere_radii[k]
+        disc = half_b * half_b - a * c
+        if disc < 0.0:
+            continue
+        sqrt_disc = math.sqrt(disc)
+        t = (-half_b - sqrt_disc) / a
+        if t <= 0.0:
+            # the ray starts inside the sphere
+            t = (-half_b + sqrt_disc) / a
+        if 0.0 < t < t_hit:
+            t_hit = t
+            index = k
+            for i in range(3):
+                hit_loc[i] = ray_orig[i] + t * ray_dir[i]
+                hit_norm[i] = (hit_loc[i] - sphere_centers[k, i]) / sphere_radii[k]
+
+    # intersect the plane, then check the hit is within the rectangle
+    n_spheres = sphere_centers.shape[0]
+    for k in range(plane_centers.shape[0]):
+        d_dot_n = 0.0
+        co_dot_n = 0.0
+        for i in range(3):
+            d_dot_n += ray_dir[i] * plane_normals[k, i]
+            co_dot_n += (plane_centers[k, i] - ray_orig[i]) * plane_normals[k, i]
+        if abs(d_dot_n) < 1e-12:
+            continue
+        t = co_dot_n / d_dot_n
+        if not 0.0 < t < t_hit:
+            continue
+        p_dot_u = 0.0
+        p_dot_v = 0.0
+        u_sq = 0.0
+        v_sq = 0.0
+        for i in range(3):
+            p = ray_orig[i] + t * ray_dir[i] - plane_centers[k, i]
+            p_dot_u += p * plane_u[k, i]
+            p_dot_v += p * plane_v[k, i]
+            u_sq += plane_u[k, i] * plane_u[k, i]
+            v_sq += plane_v[k, i] * plane_v[k, i]
+        if abs(p_dot_u) > u_sq or abs(p_dot_v) > v_sq:
+            continue
+        t_hit = t
+        index = n_spheres + k
+        for i in range(3):
+            hit_loc[i] = ray_orig[i] + t * ray_dir[i]
+            hit_norm[i] = plane_normals[k, i]
+
+    return index, hit_loc, hit_norm
+
+
+def _analytic_primitives(instances):
+    """Extract the scene geometry as analytic spheres and planes
+    An object is a sphere or a plane when its PRIMITIVE_PROPERTY custom property
+    is "SPHERE" or "PLANE". Spheres use the world location of the object and half
+    of its x dimension as radius, planes use the rectangle spanned by the local x
+    and y extents of their bounding box.
+    The primitives are only used when numba is available, intersecting them
+    in plain Python is slower than Blender's ray_cast.
+    Parameters
+    ----------
+    instances : list of tuple
+        Everything a ray can hit, from _ray_cast_instances()
+    Returns
+    -------
+    primitives : tuple or None
+        (hit_objects, sphere_centers, sphere_radii,
+         plane_centers, plane_u, plane_v, plane_normals)
+        hit_objects lists the objects in the order of the primitive indices
+        None when numba is not available, or when any of the instances is not
+        a marked primitive or is placed by an instancer,
+        then the scene has to be ray cast by Blender
+    """
+    if not HAVE_NUMBA:
+        return None
+    # objects placed by an instancer are never marked themselves,
+    # so a scene with instancers is always left to Blender
+    if not instances or any(is_instance for _, is_instance, _, _ in instances):
+        return None
+    spheres = [inst for inst in instances if inst[0].get(PRIMITIVE_PROPERTY) == "SPHERE"]
+    planes = [inst for inst in instances if inst[0].get(PRIMITIVE_PROPERTY) == "PLANE"]
+    if len(spheres) + len(planes) < len(instances):
+        return None
+
+    sphere_centers = np.zeros((len(spheres), 3), dtype=np.float32)
+    sphere_radii = np.zeros(len(spheres), dtype=np.float32)
+    for i, (_, _, matrix, bound_box) in enumerate(spheres):
+        sphere_centers[i] = matrix[:3, 3]
+        # half of the world space x dimension, like obj.dimensions.x / 2
+        extent_x = bound_box[:, 0].max() - bound_box[:, 0].min()
+        sphere_radii[i] = extent_x * np.linalg.norm(matrix[:3, 0]) / 2
+
+    plane_centers = np.zeros((len(planes), 3), dtype=np.float32)
+    plane_u = np.zeros((len(planes), 3), dtype=np.float32)
+    plane_v = np.zeros((len(planes), 3), dtype=np.float32)
+    plane_normals = np.zeros((len(planes), 3), dtype=np.float32)
+    for i, (_, _, matrix, bound_box) in enumerate(planes):
+        local_min, local_max = bound_box.min(axis=0), bound_box.max(axis=0)
+        half_x, half_y = (local_max - local_min)[:2] / 2
+        plane_centers[i] = matrix[:3, :3] @ ((local_min + local_max) / 2) + matrix[:3, 3]
+        plane_u[i] = matrix[:3, 0] * half_x
+        plane_v[i] = matrix[:3, 1] * half_y
+        normal = np.cross(matrix[:3, 0], matrix[:3, 1])
+        plane_normals[i] = normal / np.linalg.norm(normal)
+
+    return (
+        [obj for obj, _, _, _ in spheres + planes],
+        sphere_centers,
+        sphere_radii,
+        plane_centers,
+        plane_u,
+        plane_v,
+        plane_normals,
+    )
+
+
+def RT_trace_ray(
+    scene,
+    ray_orig,
+    ray_dir,
+    light_positions,
+    light_colors,
+    ambient,
+    materials,
+    depth=0,
+    primitives=None,
+    depsgraph=None,
+):
     """Cast a single ray into the scene
     Parameters
     ----------
     scene : bpy.types.Scene
         The scene that will be rendered
         It stores information about the camera, lights, objects, and material
-    ray_orig : Vector, float array of 3 items
+    ray_orig : Vector or numpy.ndarray, float array of 3 items
         Origin of the current ray
-    ray_dir : Vector, float array of 3 items
+    ray_dir : numpy.ndarray, float array of 3 items
         Direction of the current ray
-    lights : list of bpy_types.Object
-        The list of lights in the scene
+    light_positions : numpy.ndarray, float32 array of shape (K, 3)
+        The locations of the K lights in the scene
+    light_colors : numpy.ndarray, float32 array of shape (K, 4)
+        The colors of the lights multiplied by their energy, padded with a zero
+    ambient : numpy.ndarray, float32 array of 4 items
+        The ambient color of the scene, padded with a zero
+    materials : dict of int to MatSnap
+        The material snapshots of the objects, keyed by Object.as_pointer()
+        of the original objects, it is only read while rendering
     depth: int
         The recursion depth of raytracing
         i.e. the number that light bounces in the scene
+        Reflected and transmitted rays are traced iteratively with a stack,
+        so this does not add Python call frames
+    primitives : tuple or None
+        The analytic scene geometry from _analytic_primitives()
+        None to ray cast with Blender
+    depsgraph : bpy.types.Depsgraph or None
+        The dependency graph of the scene, to skip looking it up for every ray
     Returns
     -------
-    color : Vector, float array of 3 items
-        Color of the pixel
+    color : numpy.ndarray, float32 array of 4 items
+        RGB color of the pixel, padded with a zero
     """
 
-    # first, we cast a ray into the scene using Blender's built-in function
-    has_hit, hit_loc, hit_norm, _, hit_obj, _ = ray_cast(scene, ray_orig, ray_dir)
-
     # set initial color (black) for the pixel
-    color = np.zeros(3)
-
-    # if the ray hits nothing in the scene
-    # return initial color (black)
-    if not has_hit:
-        return color
+    # all colors carry a zero fourth lane, which keeps the arithmetic 4 wide
+    color = np.zeros(4, dtype=np.float32)
 
     # small offset to prevent self-occlusion for secondary rays
     eps = 1e-3
-    # ray_cast returns the surface normal of the object geometry
-    # this normal may be facing the other way when the ray origin is inside the object
-    # here we flip the normal if its wrong, and populate the ray_is_inside variable
-    # which will be handy when calculating transmission direction
-    ray_inside_object = False
-    if hit_norm.dot(ray_dir) > 0:
-        hit_norm = -hit_norm
-        ray_inside_object = True
-
-    # get the ambient color of the scene
-    ambient_color = scene.simpleRT.ambient_color
-
-    # get the material of the object we hit
-    mat = hit_obj.simpleRT_material
-
-    # extract the diffuse and specular colors from the material
-    # since we only need RGB instead of RGBA,
-    # we use .xyz to extract the first three component of the color vector
-    diffuse_color = Vector(mat.diffuse_color).xyz
-    specular_color = Vector(mat.specular_color).xyz
-    # get specular hardness aka the Phong exponent
-    specular_hardness = mat.specular_hardness
-
-    # set flag for light hit. Will later be used to apply ambient light
-    no_light_hit = True
-
-    # iterate through all the lights in the scene
-    for light in lights:
-        # get light color
-        light_color = np.array(
-            light.data.simpleRT_light.color * light.data.simpleRT_light.energy
+
+    # rays that are still to be traced, as (throughput, origin, direction, depth)
+    # throughput is the weight of the ray's color in the pixel color,
+    # i.e. the product of the k_r and (1 - k_r) * transmission factors along its path
+    stack = [(1.0, ray_orig, ray_dir, depth)]
+    while stack:
+        throughput, ray_orig, ray_dir, depth = stack.pop()
+        # all the vector math below is done on float32 arrays of 3 items,
+        # converting back and forth between Vector and numpy.ndarray is costly
+        ray_dir = np.asarray(ray_dir, dtype=np.float32)
+
+        # first, we cast a ray into the scene using Blender's built-in function
+        # or the analytic primitives when the scene consists of them only
+        has_hit, hit_loc, hit_norm, _, hit_obj, _ = ray_cast(
+            scene, ray_orig, ray_dir, primitives, depsgraph
         )
 
+        # if the ray hits nothing in the scene
+        # it adds nothing (black) to the pixel color
+        if not has_hit:
+            continue
+
+        hit_loc = np.array(hit_loc, dtype=np.float32)
+        hit_norm = np.array(hit_norm, dtype=np.float32)
+
+        # ray_cast returns the surface normal of the object geometry
+        # this normal may be facing the other way when the ray origin is inside the object
+        # here we flip the normal if its wrong, and populate the ray_is_inside variable
+        # which will be handy when calculating transmission direction
+        # D dot N is also needed by the fresnel term and the reflection direction
+        d_dot_n = _dot3(ray_dir, hit_norm)
+        # which side the ray hits is effectively random, so instead of branching
+        # the normal is multiplied by -1 when D dot N > 0 and by 1 otherwise
+        sign = -math.copysign(1.0, d_dot_n)
+        hit_norm *= np.float32(sign)
+        d_dot_n *= sign
+        ray_inside_object = sign < 0
+
+        # secondary rays start a small offset along the normal, which stays clear of
+        # the surface even when their direction is nearly tangent to it
+        # rays leaving on the side the ray came from start above the surface,
+        # transmitted rays start below it
+        orig_above = hit_loc + eps * hit_norm
+        orig_below = hit_loc - eps * hit_norm
+
+        # get the material of the object we hit
+        msnap = materials.get(hit_obj.as_pointer())
+        if msnap is None:
+            # materials holds every object a ray can hit, a miss means that
+            # the hit object is the evaluated copy of one of them
+            msnap = materials[hit_obj.original.as_pointer()]
+
+        # extract the diffuse and specular colors from the material
+        diffuse_color = msnap.diffuse
+        specular_color = msnap.specular
+        # get specular hardness aka the Phong exponent
+        specular_hardness = msnap.specular_hardness
+
         # ----------
         # TODO 1: Shadow Ray
         #
         # We cast a shadow ray that begins at the intersection point between our initial ray from the camera
-        # and our object. The shadow ray goes towards the direction of the light that we are inspecting in
-        # this current iteration of the for-loop. We declared this intersection point hit_loc above, short for
-        # hit location. Finish the code below to see if this hit location is in shadow...
-        #
-        # First, calculate the direction vector from the hit location to the light and call it light_vec.
-        # The location of the light can be accessed through light.location.
-        light_vec = light.location - hit_loc
-        
-        # Normalize light_vec and save that as light_dir.
-        light_dir = light_vec.normalized()
-        
-        # Calculate the origin of the shadow ray: new_orig.
-        # Remember to account for spurious self-occlusion!
-        new_orig = hit_loc + eps * light_dir
+        # and our object, towards each light. If it hits something before reaching the light,
+        # then the hit location is in the shadow of that light.
         #
-        # Cast the shadow ray from the hit location to the light using Blender's ray cast function.
-        has_light_hit, _, _, _, _, _ = ray_cast(
-            scene, new_orig, light_dir
-        )  # DO NOT CHANGE
+        # The work is split in three passes over all the lights, each a single batch:
+        # 1. the per-light state: directions to the lights and I_light, the light color
+        #    attenuated by the inverse-square law, with one row per light
+        light_vecs = light_positions - hit_loc
+        inv_dists_sq = 1.0 / np.einsum("ij,ij->i", light_vecs, light_vecs)
+        light_dirs = light_vecs * np.sqrt(inv_dists_sq)[:, None]
+        light_intensities = light_colors * inv_dists_sq[:, None]
+
+        # 2. the shadow test, masking out the lights we are in shadow of
+        # Cast the shadow rays, starting a small offset away to prevent spurious self-occlusion.
+        lit = np.array(
+            [
+                not ray_cast(scene, orig_above, light_dir, primitives, depsgraph)[0]
+                for light_dir in light_dirs
+            ],
+            dtype=bool,
+        )
         #
         # Re-run this script, and render the scene to check your result with Checkpoint 1.
         # If you see black pixels, then you might have done your check for self-occlusion wrong.
@@ -149,156 +693,113 @@ def RT_trace_ray(scene, ray_orig, ray_dir, lights, depth=0):
 
         # ----------
         # TODO 2: Blinn-Phong BRDF
-        # 
-        # If our shadow ray hits something before reaching the light, then we are in the shadow of the light,
-        # and the ray_cast function above will return an appropriate boolean in has_light_hit.
-        if has_light_hit:
-            continue # We are in shadow, so this light will have no contribution to the color.
-        # Otherwise, we calculate the color at our intersection point using the Blinn-Phong BRDF model. Let
-        else:
-        # I represent our color:
-        # 
+        #
+        # The lights we are in shadow of have no contribution to the color. For the others, we calculate
+        # the color at our intersection point using the Blinn-Phong BRDF model. Let I represent our color:
+        #
         # I = I_diffuse + I_specular
-        #       I_diffuse: diffuse component
-        #       I_specular: specular component
+        #       I_diffuse = k_diffuse * I_light * (light_dir dot normal_dir)
+        #       I_specular = k_specular * I_light * (normal_dir dot half_vector)^power
+        # where I_light is light_color attenuated by the inverse-square law,
+        # and half_vector is the normalized vector of light_dir + view_dir.
+        #
+        # 3. the shading of all the lit lights, accumulated in a single call to the shader
+        # The arithmetic lives in a shader from _make_shader so that it can be compiled by numba.
+        shade = _make_shader(len(light_positions), specular_hardness)
+        color += throughput * shade(
+            hit_norm,
+            ray_dir,
+            light_dirs,
+            light_intensities,
+            lit,
+            diffuse_color,
+            specular_color,
+        )
         #
-        # The diffuse component can be calculated as:
-        # I_diffuse = k_diffuse * I_light * (light_dir dot normal_dir)
-        #       k_diffuse: intensity of diffuse component, in our case diffuse_color
-        #       I_light: intensity of the light, light_color attenuated by inverse-square law
-        #       light_dir: direction from the surface point to the light, in our case light_dir
-        #       normal_dir: normal at the point on the surface, in our case hit_norm
+        # Re-run this script, and render the scene to check your result
+        # ----------
+
+        # ----------
+        # TODO 3: AMBIENT
         #
-        # The specular component can be calculated as:
-        # I_specular = k_specular * I_light
-        #              * (normal_dir dot half_vector)^power
-        #       k_specular: intensity of specular component, in our case specular_color
-        #       I_light: same as above
-        #       normal_dir: same as above
-        #       half_vector: halfway vector between the view direction and light direction
-        #       power: in our case specular_hardness
-        # where:
-        #       half_vector = the normalized vector of light_dir + view_dir
-        #           light_dir: same as above
-        #           view_dir: direction from the surface point to the viewer, the negative of ray_dir
-        
-        # Calculate intensity of the light, I_light, and scale it inversely by the distance
-            I_light = light_color / light_vec.length_squared
-        
-        # Calculate diffuse component and add that to the pixel color
+        # If none of the lights hit the object, add the ambient component I_ambient to the pixel color
+        # else, pass here. Look at the source code above and do some pattern matching to find the variable
+        # that contains our ambient color.
         #
-            diffuse_component = np.array(diffuse_color) * I_light * (np.dot(light_dir,hit_norm))
-            color += np.array(diffuse_component) 
- 
+        # I_ambient = k_diffuse * k_ambient
+        if not lit.any():
+            #FORMULA IS: ka*Ia where ka: ambient color and Ia: ambient light intensity.
+            #print(diffuse_color)
+            I_ambient = diffuse_color * ambient
+            color += throughput * I_ambient
+
+            continue
         #
-        # Re-run this script, and render the scene to check your result 
+        # Re-run this script, and render the scene to check your result with Checkpoint 3.
         # ----------
-        # Calculate specular component and add that to the pixel color
-            half_vector = (light_dir + (-ray_dir))
-            half_vector /= np.linalg.norm(half_vector)  # Normalizing the half vector
-    
-    # I_specular = k_specular * I_light * (normal_dir dot half_vector)^power
-            power = specular_hardness  # Adjust to control sharpness of highlights
-            specular_component = np.array(specular_color) * I_light * (np.dot(hit_norm, half_vector) ** power)
-            color += specular_component
-
-    # Set flag for light hit
-            no_light_hit = False
-
-    # ----------
-    # TODO 3: AMBIENT
-    #
-    # If none of the lights hit the object, add the ambient component I_ambient to the pixel color
-    # else, pass here. Look at the source code above and do some pattern matching to find the variable
-    # that contains our ambient color.
-    #
-    # I_ambient = k_diffuse * k_ambient
-    if no_light_hit:
-        #FORMULA IS: ka*Ia where ka: ambient color and Ia: ambient light intensity.
-        #print(diffuse_color)
-        I_ambient = diffuse_color * Vector(ambient_color)
-        color += I_ambient
 
-        return color
-    #
-    # Re-run this script, and render the scene to check your result with Checkpoint 3.
-    # ----------
-
-    # ----------
-    # TODO 5: FRESNEL
-    #
-    # In case we don't use fresnel, get reflectivity k_r directly using:
-    reflectivity = mat.mirror_reflectivity
-    # Otherwise, calculate k_r using Schlick’s approximation
-    if mat.use_fresnel:
-        # calculate R_0: R_0 = ((n1 - n2) / (n1 + n2))^2
-        # Here n1 is the IOR of air, so n1 = 1
-        # n2 is the IOR of the object, you can read it from the material property using: mat.ior
-        R_0 = ((1 - mat.ior) / (1 + mat.ior)) ** 2
-        theta = abs(ray_dir.dot(hit_norm))
-        # 
-        # Calculate reflectivity k_r = R_0 + (1 - R_0) (1 - cos(theta))^5 where theta is the incident angle.
-        reflectivity = R_0 + (1 - R_0) * (1 - theta) ** 5
-    #
-    # Re-run this script, and render the scene to check your result with Checkpoint 5.
-    # ----------
-
-    # ----------
-    # TODO 4: RECURSION AND REFLECTION
-    # If the depth is greater than zero, generate a reflected ray from the current x
-    # If the depth is greater than zero, generate a reflected ray from the current intersection point using the direction D_reflect to determine the color contribution L_reflect.  
-    # Multiply L_reflect by the reflectivity k_r, and then combine the result with the pixel color.
-    #
-    # Similar to how we handle shadow ray casting, it's important to account for self-occlusion in this context as well.
-    # Remember to update depth at the end!
-    if depth > 0:
-        # Get the direction for reflection ray
-        # D_reflect = D - 2 (D dot N) N
-        D_reflect = ray_dir - Vector(2 * np.dot(ray_dir, hit_norm) * hit_norm)
-
-
-        
-        # Recursively trace the reflected ray and store the return value as a color L_reflect
-        reflect_color = RT_trace_ray(scene, hit_loc + eps * D_reflect, D_reflect, lights, depth - 1)
-
-
-        
-        # Add reflection to the final color: k_r * L_reflect
-        color += reflectivity * reflect_color
+        # ----------
+        # TODO 5: FRESNEL
+        #
+        # In case we don't use fresnel, get reflectivity k_r directly using:
+        reflectivity = msnap.mirror_reflectivity
+        # Otherwise, calculate k_r using Schlick’s approximation
+        if msnap.use_fresnel:
+            # R_0 = ((n1 - n2) / (n1 + n2))^2 with n1 = 1 for air and n2 = msnap.ior,
+            # k_r = R_0 + (1 - R_0) (1 - cos(theta))^5 where theta is the incident angle.
+            theta = abs(d_dot_n)
+            reflectivity = _fresnel_schlick(theta, msnap.ior)
         #
-        # Re-run this script, and render the scene to check your result with Checkpoint 4.
+        # Re-run this script, and render the scene to check your result with Checkpoint 5.
         # ----------
 
         # ----------
-        # TODO 6: TRANSMISSION
+        # TODO 4: RECURSION AND REFLECTION
+        # If the depth is greater than zero, generate a reflected ray from the current x
+        # If the depth is greater than zero, generate a reflected ray from the current intersection point using the direction D_reflect to determine the color contribution L_reflect.  
+        # Multiply L_reflect by the reflectivity k_r, and then combine the result with the pixel color.
         #
-        # If the depth is greater than zero, generate a transmitted ray from the current 
-        # point of intersection using the direction D_transmit to calculate the color contribution L_transmit. 
-        # Multiply this by (1 - k_r) * mat.transmission, and then add the result into the pixel color.
+        # Similar to how we handle shadow ray casting, it's important to account for self-occlusion in this context as well.
+        # Remember to update depth at the end!
         #
-        # Ensure that the refractive indices (n1 and n2) are assigned based on the media through which the ray is passing (as specified by ray_inside_object)
-        # Use the refractive index of the object (mat.ior) and set the refractive index of air as 1
-        # Proceed with the calculation of D_transmit only if the value under the square root is positive.
-        if mat.transmission > 0:
-            n1, n2 = (mat.ior, 1) if ray_inside_object else (1, mat.ior)
-            n_ratio = n1 / n2
-            cos_theta_i = -hit_norm.dot(ray_dir)
-            cos_theta_t2 = 1 - n_ratio ** 2 * (1 - cos_theta_i ** 2)
-            if cos_theta_t2 >= 0:
-                D_transmit = n_ratio * ray_dir + (n_ratio * cos_theta_i - sqrt(cos_theta_t2)) * hit_norm
-                transmit_color = RT_trace_ray(scene, hit_loc + eps * D_transmit, D_transmit, lights, depth - 1)
-                color += (1 - reflectivity) * mat.transmission * transmit_color
-                
-    #
-    # Re-run this script, and render the scene to check your result with Checkpoint 6.
-    # ----------
+        # A secondary ray whose weight in the pixel color is below MIN_THROUGHPUT would not
+        # visibly change the image, so it is not traced at all.
+        if depth > 0:
+            # its color L_reflect is added to the pixel color weighted by k_r
+            reflect_weight = throughput * reflectivity
+            if reflect_weight > MIN_THROUGHPUT:
+                # Get the direction for reflection ray
+                # D_reflect = D - 2 (D dot N) N
+                D_reflect = ray_dir - np.float32(2.0 * d_dot_n) * hit_norm
+                # Queue the reflected ray, it is shaded once it is popped from the stack
+                stack.append((reflect_weight, orig_above, D_reflect, depth - 1))
+            #
+            # Re-run this script, and render the scene to check your result with Checkpoint 4.
+            # ----------
 
-    return color
-    #
-    # Re-run this script, and render the scene to check your result with Checkpoint 6.
-    # ----------
+            # ----------
+            # TODO 6: TRANSMISSION
+            #
+            # If the depth is greater than zero, generate a transmitted ray from the current 
+            # point of intersection using the direction D_transmit to calculate the color contribution L_transmit. 
+            # Multiply this by (1 - k_r) * msnap.transmission, and then add the result into the pixel color.
+            #
+            # Ensure that the refractive indices (n1 and n2) are assigned based on the media through which the ray is passing (as specified by ray_inside_object)
+            # Use the refractive index of the object (msnap.ior) and set the refractive index of air as 1
+            # Proceed with the calculation of D_transmit only if the value under the square root is positive.
+            # L_transmit is weighted by (1 - k_r) * msnap.transmission
+            transmit_weight = throughput * (1 - reflectivity) * msnap.transmission
+            if transmit_weight > MIN_THROUGHPUT:
+                n1, n2 = (msnap.ior, 1) if ray_inside_object else (1, msnap.ior)
+                has_transmit, D_transmit = _refract(ray_dir, hit_norm, n1 / n2)
+                if has_transmit:
+                    stack.append((transmit_weight, orig_below, D_transmit, depth - 1))
 
-    
+        #
+        # Re-run this script, and render the scene to check your result with Checkpoint 6.
+        # ----------
+
+    return color
 
 
 def RT_render_scene(scene, width, height, depth, buf):
@@ -315,13 +816,41 @@ def RT_render_scene(scene, width, height, depth, buf):
     depth : int
         The recursion depth of raytracing
         i.e. the number that light bounces in the scene
-    buf: numpy.ndarray
+    buf: numpy.ndarray, float32
         the buffer that will be populated to store the calculated color
         for each pixel
     """
 
+    # resolve the dependency graph once, instead of for every ray cast
+    depsgraph = scene.view_layers[0].depsgraph
+
     # get all the lights from the scene
     scene_lights = [o for o in scene.objects if o.type == "LIGHT"]
+    # and their location and color as float32 rows, one per light
+    # these are read through bpy once here instead of for every hit
+    light_positions = np.array(
+        [l.location for l in scene_lights], dtype=np.float32
+    ).reshape(-1, 3)
+    light_colors = np.array(
+        [
+            _rgb0(l.data.simpleRT_light.color, l.data.simpleRT_light.energy)
+            for l in scene_lights
+        ],
+        dtype=np.float32,
+    ).reshape(-1, 4)
+    # the ambient color of the scene, read once here instead of on unlit hits
+    ambient = _rgb0(scene.simpleRT.ambient_color)
+
+    # everything a ray can hit, instanced objects included
+    instances = _ray_cast_instances(depsgraph)
+
+    # read the materials of all the objects a ray can hit once, on the main thread,
+    # the render threads only look them up and never read material data from bpy
+    materials = {}
+    for obj, _, _, _ in instances:
+        # an object placed many times by an instancer is read only once
+        if obj.as_pointer() not in materials:
+            materials[obj.as_pointer()] = MatSnap.from_object(obj)
 
     # get the location and orientation of the active camera
     cam_location = scene.camera.location
@@ -331,25 +860,103 @@ def RT_render_scene(scene, width, height, depth, buf):
     focal_length = scene.camera.data.lens / scene.camera.data.sensor_width
     aspect_ratio = height / width
 
-    # iterate through all the pixels, cast a ray for each pixel
-    for y in range(height):
-        # get screen space coordinate for y
-        screen_y = ((y - (height / 2)) / height) * aspect_ratio
-        for x in range(width):
-            # get screen space coordinate for x
-            screen_x = (x - (width / 2)) / width
-            # calculate the ray direction
-            ray_dir = Vector((screen_x, screen_y, -focal_length))
-            ray_dir.rotate(cam_orientation)
-            ray_dir = ray_dir.normalized()
-            # populate the RGB component of the buffer with ray tracing result
-            buf[y, x, 0:3] = RT_trace_ray(
-                scene, cam_location, ray_dir, scene_lights, depth
-            )
-            # populate the alpha component of the buffer
-            # to make the pixel not transparent
-            buf[y, x, 3] = 1
-        yield y
+    # the camera space ray direction of pixel (x, y) is
+    # (screen_x, screen_y, -focal_length) with
+    #     screen_x = (x - width / 2) / width
+    #     screen_y = ((y - height / 2) / height) * aspect_ratio
+    # which is linear in (x, y, 1), so it is written as a 3x3 matrix
+    screen_to_camera = np.array(
+        [
+            [1 / width, 0, -0.5],
+            [0, aspect_ratio / height, -0.5 * aspect_ratio],
+            [0, 0, -focal_length],
+        ],
+        dtype=np.float32,
+    )
+    # bake the camera rotation into the same matrix once,
+    # instead of converting the euler angles in Vector.rotate() for every pixel
+    cam_rotation = np.asarray(cam_orientation.to_matrix(), dtype=np.float32)
+    screen_to_world = cam_rotation @ screen_to_camera
+
+    # generate the primary ray directions for all the pixels at once
+    # with a single matmul of the (height, width, 3) array of pixel coordinates
+    grid_x, grid_y = np.meshgrid(
+        np.arange(width, dtype=np.float32), np.arange(height, dtype=np.float32)
+    )
+    pixels = np.stack([grid_x, grid_y, np.ones_like(grid_x)], -1)
+    ray_dirs = pixels @ screen_to_world.T
+    ray_dirs /= np.linalg.norm(ray_dirs, axis=-1, keepdims=True)
+
+    # when the scene is made of marked spheres and planes only,
+    # rays are intersected with them directly instead of going through Blender
+    primitives = _analytic_primitives(instances)
+
+    # bounding boxes of everything a ray can hit, a primary ray that misses all
+    # of them is black without going through ray_cast
+    bounds_min, bounds_max = _world_bounds(instances)
+    cam_orig = np.array(cam_location, dtype=np.float32)
+    # reciprocal of the ray directions for the slab test, a zero component
+    # gets a huge finite value instead of inf so that 0 * inv_dir is never nan
+    inv_dirs = 1.0 / np.where(np.abs(ray_dirs) < 1e-12, 1e-12, ray_dirs)
+    # test all the primary rays against the boxes at once,
+    # instead of a Python level slab test per pixel
+    hit_mask = _primary_hit_mask(cam_orig, inv_dirs, bounds_min, bounds_max)
+
+    def render_tile(tile):
+        # iterate through all the pixels of the tile, cast a ray for each pixel
+        # neighbouring pixels are traced back-to-back this way, so consecutive rays
+        # go through the same region of the scene and of Blender's BVH
+        tile_y, tile_y_end, tile_x, tile_x_end = tile
+        for y in range(tile_y, tile_y_end):
+            for x in range(tile_x, tile_x_end):
+                # the RGB component stays black if the ray cannot hit anything
+                if hit_mask[y, x]:
+                    # populate the RGB component of the buffer with ray tracing result
+                    # the color is 4 wide, so it is copied as a whole pixel
+                    buf[y, x] = RT_trace_ray(
+                        scene,
+                        cam_orig,
+                        ray_dirs[y, x],
+                        light_positions,
+                        light_colors,
+                        ambient,
+                        materials,
+                        depth,
+                        primitives,
+                        depsgraph,
+                    )
+                # populate the alpha component of the buffer
+                # to make the pixel not transparent
+                buf[y, x, 3] = 1
+        return tile
+
+    # split the image into tiles of (y, y_end, x, x_end)
+    tiles = [
+        (tile_y, min(tile_y + TILE_SIZE, height), tile_x, min(tile_x + TILE_SIZE, width))
+        for tile_y in range(0, height, TILE_SIZE)
+        for tile_x in range(0, width, TILE_SIZE)
+    ]
+    # number of tiles left to render in each row of tiles
+    tiles_left = {}
+    for tile in tiles:
+        tiles_left[tile[0]] = tiles_left.get(tile[0], 0) + 1
+
+    # every pixel is independent, so the tiles are rendered by a pool of threads
+    # each tile writes directly into its own slice of buf
+    executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+    try:
+        futures = [executor.submit(render_tile, tile) for tile in tiles]
+        next_row = 0
+        for future in as_completed(futures):
+            tiles_left[future.result()[0]] -= 1
+            # report the rows of tiles that are done, in order
+            while next_row < height and tiles_left[next_row] == 0:
+                next_row = min(next_row + TILE_SIZE, height)
+                # all the rows up to the end of this row of tiles are done
+                yield next_row - 1
+    finally:
+        # do not start the remaining tiles when the render is cancelled
+        executor.shutdown(wait=True, cancel_futures=True)
     return buf
 
 
@@ -389,11 +996,9 @@ class SimpleRTRenderEngine(bpy.types.RenderEngine):
         # create a buffer to store the calculated intensities
         # buffer is has four channels: Red, Green, Blue, and Alpha
         # default is set to (0, 0, 0, 0), which means black and fully transparent
+        # Blender stores the pixels as float32, so the buffer does too
         height, width = self.size_y, self.size_x
-        buf = np.zeros((height, width, 4))
-
-        result = self.begin_result(0, 0, self.size_x, self.size_y)
-        layer = result.layers[0].passes["Combined"]
+        buf = np.zeros((height, width, 4), dtype=np.float32)
 
         # get the maximum ray tracing recursion depth
         depth = scene.simpleRT.recursion_depth
@@ -406,6 +1011,8 @@ class SimpleRTRenderEngine(bpy.types.RenderEngine):
 
         # start ray tracing
         update_cycle = int(10000 / width)
+        # rows below this one have already been sent to Blender
+        flushed_rows = 0
         for y in RT_render_scene(scene, width, height, depth, buf):
 
             # print render time info
@@ -422,15 +1029,28 @@ class SimpleRTRenderEngine(bpy.types.RenderEngine):
 
             # update render result
             # update too frequently will significantly slow down the rendering
-            if y % update_cycle == 0 or y == height - 1:
-                self.update_result(result)
-                layer.rect = buf.reshape(-1, 4).tolist()
+            # RT_render_scene yields once per row of tiles
+            if y + 1 - flushed_rows >= update_cycle:
+                self.update_rows(buf, flushed_rows, y + 1)
+                flushed_rows = y + 1
 
             # catch "ESC" event to cancel the render
             if self.test_break():
                 break
 
         # tell Blender all pixels have been set and are final
+        self.update_rows(buf, flushed_rows, height)
+
+    def update_rows(self, buf, y_start, y_end):
+        # send only the rows [y_start, y_end) of the buffer to Blender,
+        # as a render result covering just that band of the image
+        if y_end <= y_start:
+            return
+        result = self.begin_result(0, y_start, self.size_x, y_end - y_start)
+        layer = result.layers[0].passes["Combined"]
+        # foreach_set copies the flat float32 rows directly,
+        # without building a Python list of the pixels
+        layer.rect.foreach_set(buf[y_start:y_end].ravel())
         self.end_result(result)
 
 